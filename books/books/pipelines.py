@@ -1,7 +1,39 @@
-import motor.motor_asyncio
-from pydantic import ValidationError
+import asyncio
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import zstandard as zstd
+from gridfs import AsyncGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from scrapy.exceptions import DropItem
-from .schema import Book, ChangeLog
+from scrapy.utils.defer import deferred_from_coro
+from .schema import Book, RawPage
+
+# The model's pydantic-core serializer, called directly to skip the argument
+# handling that `model_dump` repeats on every call.
+_BOOK_DUMPER = Book.__pydantic_serializer__.to_python
+
+# --- Rating Conversion Map ---
+RATING_MAP = {
+    "One": 1.0,
+    "Two": 2.0,
+    "Three": 3.0,
+    "Four": 4.0,
+    "Five": 5.0,
+}
+
+_PRICE_RE = re.compile(r"[\d.]+")
+
+
+def parse_price(price_str):
+    """Convert price like '£18.02' → 18.02."""
+    if not price_str:
+        return None
+    match = _PRICE_RE.search(price_str)
+    return float(match.group()) if match else None
 
 class MongoPipeline:
     """
@@ -12,26 +44,89 @@ class MongoPipeline:
     2.  Checks if a book already exists in the database.
     3.  If the book is new, it's added to the `books` collection and a 'new'
         entry is created in the `changelog` collection.
-    4.  If the book exists, it compares tracked fields (e.g., price, availability)
-        for changes. Any detected changes are logged as 'update' entries in the
-        `changelog` collection, and the main book record is updated.
-    5.  Stores a snapshot of the raw HTML for each book in a separate `raw_html`
-        collection for archival purposes.
+    4.  If the book exists, it compares a hash of the tracked fields (e.g.,
+        price, availability) with the stored one. Only when the hashes differ
+        are the fields themselves fetched and compared; any detected changes
+        are logged as 'update' entries in the `changelog` collection, and the
+        main book record is updated.
+    5.  Stores numeric/normalized copies of fields the API filters and sorts
+        on (e.g. `price_numeric`), so those queries can run inside MongoDB.
+    6.  Stores a zstd-compressed snapshot of the raw HTML for each book in the
+        `raw_html` GridFS bucket for archival purposes.
+
+    Persistence is decoupled from scraping: `process_item` only places the
+    book on a bounded queue, and a small pool of background writer tasks
+    drains it in batches of up to `batch_size` books, each written with a
+    few unordered bulk operations (`insert_many` for new books and changelog
+    entries, `bulk_write` for updated books). A slow MongoDB round-trip therefore
+    no longer stalls the crawl until the queue is full. Raw HTML arrives as
+    separate `RawPage` items and goes through its own queue and writer tasks,
+    so page bodies never pass through the book batches.
     """
     # Define collection names for clarity and easy modification.
     BOOKS_COLLECTION = "books"
-    HTML_COLLECTION = "raw_html"
+    HTML_BUCKET = "raw_html"
     CHANGELOG_COLLECTION = "changelog"
-    
-    # List of fields to monitor for updates in existing books.
-    FIELDS_TO_TRACK = ["price_incl_tax", "availability", "rating"]
 
-    def __init__(self, mongo_uri, mongo_db):
+    # List of fields to monitor for updates in existing books; these are the
+    # fields covered by `Book.tracked_hash`.
+    FIELDS_TO_TRACK = list(Book.TRACKED_FIELDS)
+
+    # Default maximum number of books written together in one batch; the
+    # `MONGO_BATCH_SIZE` setting overrides it.
+    BATCH_SIZE = 200
+
+    # --- Background writers ---
+    # Books waiting to be written; `process_item` blocks once this many are queued.
+    QUEUE_SIZE = 1000
+    # Number of concurrent writer tasks draining the queue.
+    WRITER_COUNT = 4
+    # Number of concurrent writer tasks archiving raw pages. Each page costs
+    # several sequential GridFS round-trips, so pages are archived in parallel.
+    HTML_WRITER_COUNT = 8
+    # Longest time (in seconds) a partial batch waits for more books before being written.
+    FLUSH_INTERVAL = 0.2
+
+    # MongoDB error code for a duplicate key, e.g. a book another crawler inserted first.
+    DUPLICATE_KEY_ERROR = 11000
+    # MongoDB error code for dropping an index that does not exist.
+    INDEX_NOT_FOUND_ERROR = 27
+
+    # Indexes created by earlier versions of the pipeline and since replaced
+    # by the ones `_open` creates, keyed by collection. They are dropped so
+    # that existing databases do not keep maintaining them.
+    SUPERSEDED_INDEXES = {
+        BOOKS_COLLECTION: [
+            # Change-detection index over the tracked fields themselves,
+            # replaced by the one over `tracked_hash`.
+            "_id_1_price_incl_tax_1_availability_1_rating_1",
+            # Earlier key specs of the API's listing index.
+            "category_1_price_numeric_1",
+            "category_1_price_numeric_1_rating_numeric_1_reviews_1",
+            "category_lower_1_price_numeric_1_rating_numeric_1_reviews_1",
+        ],
+    }
+
+    # Maximum number of books whose tracked-field hash is kept in the local cache.
+    SEEN_CACHE_SIZE = 4096
+
+    # zstd level used for raw HTML snapshots; 3 is zstd's default speed/ratio trade-off.
+    HTML_COMPRESSION_LEVEL = 3
+
+    def __init__(self, mongo_uri, mongo_db, batch_size=BATCH_SIZE):
         """Initializes the pipeline with MongoDB connection details."""
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
+        self.batch_size = batch_size
         self.client = None
         self.db = None
+        self._queue = None
+        self._html_queue = None
+        self._html_bucket = None
+        self._writers = []
+        # Most recently seen tracked-field hash per book ID, in LRU order.
+        self._seen = OrderedDict()
+        self._compressor = zstd.ZstdCompressor(level=self.HTML_COMPRESSION_LEVEL)
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -42,106 +137,405 @@ class MongoPipeline:
         return cls(
             mongo_uri=crawler.settings.get("MONGO_URI"),
             mongo_db=crawler.settings.get("MONGO_DATABASE", "books_db"),
+            batch_size=crawler.settings.getint("MONGO_BATCH_SIZE", cls.BATCH_SIZE),
         )
 
     def open_spider(self, spider):
         """
         Called when the spider is opened.
-        Establishes the connection to the MongoDB database.
+        Establishes the connection to the MongoDB database, ensures the
+        indexes used by the pipeline exist and starts the background writers.
+
+        Returns a Deferred so that Scrapy waits for this setup to complete
+        before items start flowing through the pipeline.
         """
-        self.client = motor.motor_asyncio.AsyncIOMotorClient(self.mongo_uri)
+        # Compress traffic on the wire as well; zlib is the fallback for
+        # servers built without zstd support.
+        self.client = AsyncMongoClient(self.mongo_uri, compressors="zstd,zlib")
         self.db = self.client[self.mongo_db]
+        self._seen = OrderedDict()
+        return deferred_from_coro(self._open(spider))
+
+    async def _open(self, spider):
+        """Creates the indexes used by the pipeline's queries and starts the writer tasks."""
+        # Covers the change-detection lookup, which fetches only the tracked
+        # hash by `_id`, so it can be answered from the index alone.
+        await self.db[self.BOOKS_COLLECTION].create_index(
+            [("_id", ASCENDING), ("tracked_hash", ASCENDING)]
+        )
+        # Serves the API's book listing, filtered by category and price range
+        # and sorted by price, rating or reviews. The trailing keys are the
+        # fields the listing projects, so a listing filtered by category is
+        # covered by the index. Without a category there is no prefix to seek
+        # on: documents are fetched, or the whole index is scanned.
+        await self.db[self.BOOKS_COLLECTION].create_index([
+            ("category_lower", ASCENDING),
+            ("price_numeric", ASCENDING),
+            ("rating_numeric", DESCENDING),
+            ("reviews", DESCENDING),
+            ("_id", ASCENDING),
+            ("title", ASCENDING),
+            ("category", ASCENDING),
+            ("availability", ASCENDING),
+            ("image_url", ASCENDING),
+            ("url", ASCENDING),
+            ("crawl_timestamp", ASCENDING),
+        ])
+        # Serves per-book history lookups, newest change first.
+        await self.db[self.CHANGELOG_COLLECTION].create_index(
+            [("book_id", ASCENDING), ("timestamp", DESCENDING)]
+        )
+        # Serves the daily report's range scan over recent changes.
+        await self.db[self.CHANGELOG_COLLECTION].create_index([("timestamp", DESCENDING)])
+        try:
+            await self._drop_superseded_indexes()
+        except Exception as e:
+            # Stale indexes only cost write time; they do not affect the crawl.
+            spider.logger.error(f"Error dropping superseded indexes in MongoPipeline: {e}", exc_info=True)
+        try:
+            await self._backfill_query_fields()
+        except Exception as e:
+            # Only older books lack the fields; the crawl itself does not need them.
+            spider.logger.error(f"Error backfilling query fields in MongoPipeline: {e}", exc_info=True)
+
+        self._html_bucket = AsyncGridFSBucket(self.db, bucket_name=self.HTML_BUCKET)
+        self._queue = asyncio.Queue(self.QUEUE_SIZE)
+        self._html_queue = asyncio.Queue(self.QUEUE_SIZE)
+        self._writers = [asyncio.create_task(self._drain(spider)) for _ in range(self.WRITER_COUNT)]
+        self._writers += [asyncio.create_task(self._drain_html(spider)) for _ in range(self.HTML_WRITER_COUNT)]
         spider.logger.info("MongoDB pipeline opened and connection established.")
 
+    async def _drop_superseded_indexes(self):
+        """Drops the `SUPERSEDED_INDEXES` that still exist."""
+        for collection_name, index_names in self.SUPERSEDED_INDEXES.items():
+            for index_name in index_names:
+                try:
+                    await self.db[collection_name].drop_index(index_name)
+                except OperationFailure as e:
+                    if e.code != self.INDEX_NOT_FOUND_ERROR:
+                        raise
+
+    async def _backfill_query_fields(self):
+        """
+        Adds the derived query fields to books stored before they existed.
+
+        Unchanged books are never rewritten by the pipeline, so this one-off
+        server-side update fills them in; it matches nothing once every book
+        has been backfilled.
+        """
+        # Server-side equivalents of `_add_query_fields`, per derived field.
+        backfills = {
+            # Strip the leading currency symbol ('£51.77' → 51.77). `$strLenCP`
+            # fails on anything but a string, so other values convert to None.
+            "price_numeric": {"$convert": {
+                "input": {"$cond": [
+                    {"$eq": [{"$type": "$price_incl_tax"}, "string"]},
+                    {"$substrCP": ["$price_incl_tax", 1, {"$strLenCP": "$price_incl_tax"}]},
+                    None,
+                ]},
+                "to": "double",
+                "onError": None,
+                "onNull": None,
+            }},
+            "rating_numeric": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$rating", name]}, "then": value}
+                    for name, value in RATING_MAP.items()
+                ],
+                "default": None,
+            }},
+            "category_lower": {"$toLower": "$category"},
+        }
+        for field, expression in backfills.items():
+            await self.db[self.BOOKS_COLLECTION].update_many(
+                {field: {"$exists": False}},
+                [{"$set": {field: expression}}]
+            )
+
     def close_spider(self, spider):
         """
         Called when the spider is closed.
-        Closes the connection to the MongoDB database.
+        Waits for all queued books to be written and closes the connection to
+        the MongoDB database.
+
+        Returns a Deferred so that Scrapy waits for the final writes to complete
+        before shutting down the reactor.
         """
-        self.client.close()
+        return deferred_from_coro(self._close(spider))
+
+    async def _close(self, spider):
+        """Waits for the queues to drain, stops the writer tasks, then closes the client."""
+        try:
+            # The queues only exist once `_open` has completed; if it failed
+            # there is nothing to drain, but the client still has to be closed.
+            if self._queue is not None:
+                await self._queue.join()
+            if self._html_queue is not None:
+                await self._html_queue.join()
+            for writer in self._writers:
+                writer.cancel()
+            await asyncio.gather(*self._writers, return_exceptions=True)
+        finally:
+            await self.client.close()
         spider.logger.info("MongoDB pipeline closed.")
 
-    async def process_item(self, item, spider):
+    def _remember(self, book_id, tracked_hash):
+        """Caches the tracked-field hash of a book, evicting the least recently used entry when full."""
+        self._seen[book_id] = tracked_hash
+        self._seen.move_to_end(book_id)
+        if len(self._seen) > self.SEEN_CACHE_SIZE:
+            self._seen.popitem(last=False)
+
+    async def _get_tracked_hashes(self, book_ids):
         """
-        Asynchronously processes each item yielded by the spider.
+        Returns the stored tracked-field hash of the given books, keyed by book ID.
+        Books that are not in the database are absent from the result; books
+        stored before hashes were introduced map to None.
 
-        This is the core logic of the pipeline. It handles item validation,
-        change detection, logging, and database persistence.
+        Books seen recently in this crawl are answered from the local cache;
+        the rest are fetched from MongoDB in a single query that returns only
+        the hash.
+        """
+        hashes = {}
+        missing = []
+        for book_id in book_ids:
+            if book_id in self._seen:
+                self._seen.move_to_end(book_id)
+                hashes[book_id] = self._seen[book_id]
+            else:
+                missing.append(book_id)
 
-        Args:
-            item: The scraped item (expected to be a `Book` object).
-            spider: The spider that yielded the item.
+        if missing:
+            cursor = self.db[self.BOOKS_COLLECTION].find(
+                {"_id": {"$in": missing}},
+                projection={"tracked_hash": 1}
+            )
+            async for doc in cursor:
+                hashes[doc["_id"]] = doc.get("tracked_hash")
+                self._remember(doc["_id"], hashes[doc["_id"]])
+        return hashes
 
-        Returns:
-            The processed item.
+    async def _get_tracked_fields(self, book_ids):
+        """Fetches the stored tracked fields of the given books in a single query, keyed by book ID."""
+        if not book_ids:
+            return {}
+        cursor = self.db[self.BOOKS_COLLECTION].find(
+            {"_id": {"$in": book_ids}},
+            projection={field: 1 for field in self.FIELDS_TO_TRACK}
+        )
+        return {doc["_id"]: doc async for doc in cursor}
+
+    async def _drain(self, spider):
         """
-        # Ensure we are only processing items of the correct type.
-        if not isinstance(item, Book):
-            return item
+        Writer task: repeatedly takes a batch of books off the queue and writes it.
+
+        A batch is written as soon as it holds `batch_size` books, or
+        `FLUSH_INTERVAL` seconds after its first book arrived, whichever
+        comes first.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.FLUSH_INTERVAL
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._write_batch(batch, spider)
+            except Exception as e:
+                spider.logger.error(f"Error writing a batch of {len(batch)} books in MongoPipeline: {e}", exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _drain_html(self, spider):
+        """
+        Writer task: archives each queued raw page in GridFS, keyed by its book ID.
+
+        Any previous snapshot of the same book is replaced. Several of these
+        tasks run at once; Scrapy's duplicate filter fetches each book page
+        once per crawl, so they do not race on the same snapshot.
+        """
+        while True:
+            page = await self._html_queue.get()
+            try:
+                try:
+                    await self._html_bucket.delete(page.id)
+                except NoFile:
+                    pass
+                await self._html_bucket.upload_from_stream_with_id(
+                    page.id,
+                    f"{page.id}.html.zst",
+                    self._compressor.compress(page.body),
+                    metadata={"compression": "zstd"},
+                )
+            except Exception as e:
+                spider.logger.error(f"Error archiving raw HTML for book {page.id} in MongoPipeline: {e}", exc_info=True)
+            finally:
+                self._html_queue.task_done()
 
+    async def _insert_many(self, collection_name, docs):
+        """
+        Inserts documents in one unordered round-trip.
+
+        Duplicate-key failures are ignored: they only mean that the document
+        was inserted concurrently (e.g. by another crawler), and with
+        `ordered=False` they do not stop the rest of the batch.
+        """
+        if not docs:
+            return
         try:
-            # Dump the Pydantic model to a dictionary for MongoDB.
+            await self.db[collection_name].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            other_errors = [
+                error for error in e.details.get("writeErrors", [])
+                if error.get("code") != self.DUPLICATE_KEY_ERROR
+            ]
+            if other_errors or e.details.get("writeConcernErrors"):
+                raise
+
+    async def _write_books(self, new_books, book_ops):
+        """Inserts the new books, then applies the updates to existing ones."""
+        await self._insert_many(self.BOOKS_COLLECTION, new_books)
+        if book_ops:
+            await self.db[self.BOOKS_COLLECTION].bulk_write(book_ops, ordered=False)
+
+    @staticmethod
+    def _add_query_fields(book_doc):
+        """Adds the derived fields that the API filters and sorts on to a book document."""
+        book_doc["price_numeric"] = parse_price(book_doc.get("price_incl_tax"))
+        book_doc["rating_numeric"] = RATING_MAP.get((book_doc.get("rating") or "").strip().title())
+        book_doc["category_lower"] = (book_doc.get("category") or "").lower()
+        return book_doc
+
+    async def _write_batch(self, books, spider):
+        """
+        Runs change detection for a batch of books and persists the result.
+
+        Args:
+            books: The `Book` items to write.
+            spider: The spider that yielded the items.
+        """
+        new_books = []
+        # Update per book ID: unordered bulk operations run in no particular
+        # order, so a book seen twice in a batch gets only its latest update.
+        book_updates = {}
+        log_docs = []
+        # Hashes of the books written by this batch, cached once the writes succeed.
+        written_hashes = {}
+        # Changelog entries are built as plain dicts with the same fields as
+        # the `ChangeLog` model, sharing one detection timestamp per batch.
+        detected_at = datetime.now(timezone.utc)
+
+        # Check which books already exist in the database, and with which hash.
+        stored_hashes = await self._get_tracked_hashes([item.id for item in books])
+        # Only books whose hash differs need their old values, for the changelog.
+        stored_values = await self._get_tracked_fields([
+            item.id for item in books
+            if item.id in stored_hashes and stored_hashes[item.id] != item.tracked_hash
+        ])
+
+        for item in books:
+            if item.id in stored_hashes and stored_hashes[item.id] == item.tracked_hash:
+                # Unchanged since it was last stored: nothing to write.
+                continue
+
+            # Dump the Pydantic model to a dictionary for MongoDB, once per item.
             # `by_alias=True` ensures 'id' becomes '_id'.
-            item_dict = item.model_dump(by_alias=True)
-            raw_html = item_dict.pop("raw_html", None)
-            
-            # Check if the book already exists in the database.
-            existing_book = await self.db[self.BOOKS_COLLECTION].find_one({"_id": item.id})
+            item_dict = self._add_query_fields(_BOOK_DUMPER(item, by_alias=True, mode="python"))
 
-            if not existing_book:
+            if item.id not in stored_hashes:
                 # --- Handle New Books ---
-                log_entry = ChangeLog(
-                    book_id=item.id,
-                    field_changed="book",
-                    new_value=item.title,
-                    change_type="new"
-                )
-                await self.db[self.CHANGELOG_COLLECTION].insert_one(log_entry.model_dump(by_alias=True))
-                
-                await self.db[self.BOOKS_COLLECTION].insert_one(item_dict)
+                log_docs.append({
+                    "book_id": item.id,
+                    "field_changed": "book",
+                    "old_value": None,
+                    "new_value": item.title,
+                    "change_type": "new",
+                    "timestamp": detected_at,
+                })
+                new_books.append(item_dict)
                 spider.logger.debug(f"New book found: {item.title}")
 
             else:
                 # --- Handle Existing Books: Detect and Log Changes ---
+                existing_book = stored_values.get(item.id, {})
                 changes_found = []
                 for field in self.FIELDS_TO_TRACK:
                     # Compare string representations to handle different types gracefully.
                     new_value = str(item_dict.get(field, ''))
                     old_value = str(existing_book.get(field, ''))
                     if old_value != new_value:
-                        log_entry = ChangeLog(
-                            book_id=item.id,
-                            field_changed=field,
-                            old_value=old_value,
-                            new_value=new_value,
-                            change_type="update"
-                        )
-                        changes_found.append(log_entry)
+                        changes_found.append({
+                            "book_id": item.id,
+                            "field_changed": field,
+                            "old_value": old_value,
+                            "new_value": new_value,
+                            "change_type": "update",
+                            "timestamp": detected_at,
+                        })
 
                 if changes_found:
                     # If changes were detected, log them and update the book record.
-                    await self.db[self.CHANGELOG_COLLECTION].insert_many(
-                        [change.model_dump(by_alias=True) for change in changes_found]
-                    )
-                    await self.db[self.BOOKS_COLLECTION].update_one(
-                        {"_id": item.id},
-                        {"$set": item_dict}
-                    )
+                    # The upsert covers a book that is new in this same batch:
+                    # `_write_books` inserts new books before applying updates.
+                    log_docs.extend(changes_found)
+                    book_updates[item.id] = UpdateOne({"_id": item.id}, {"$set": item_dict}, upsert=True)
                     spider.logger.debug(f"Updated {len(changes_found)} fields for book: {item.title}")
+                else:
+                    # Same values under a different (or missing) hash, e.g. a
+                    # book stored before hashes existed: only record the hash.
+                    book_updates[item.id] = UpdateOne({"_id": item.id}, {"$set": {"tracked_hash": item.tracked_hash}})
 
-            # Always save/update the raw HTML snapshot.
-            if raw_html:
-                await self.db[self.HTML_COLLECTION].update_one(
-                    {"_id": item.id},
-                    {"$set": {"_id": item.id, "html": raw_html}},
-                    upsert=True
-                )
+            # Later occurrences of this book compare against what was just written.
+            stored_hashes[item.id] = item.tracked_hash
+            stored_values[item.id] = {field: item_dict.get(field) for field in self.FIELDS_TO_TRACK}
+            written_hashes[item.id] = item.tracked_hash
 
-        except ValidationError as e:
-            spider.logger.error(f"Pydantic validation error for item '{item.title}': {e}")
-            raise DropItem("Item failed Pydantic validation.")
-        except Exception as e:
-            spider.logger.error(f"Error processing item in MongoPipeline: {e}", exc_info=True)
-            raise DropItem("Unexpected error in MongoPipeline.")
+        # Unordered round-trips for the whole batch, with the changelog and
+        # the books written concurrently.
+        try:
+            await asyncio.gather(
+                self._insert_many(self.CHANGELOG_COLLECTION, log_docs),
+                self._write_books(new_books, list(book_updates.values())),
+            )
+        except Exception:
+            # What was stored is unknown: forget these books so that their next
+            # occurrence is compared against the database again.
+            for book_id in written_hashes:
+                self._seen.pop(book_id, None)
+            raise
 
+        for book_id, tracked_hash in written_hashes.items():
+            self._remember(book_id, tracked_hash)
+
+    async def process_item(self, item, spider):
+        """
+        Asynchronously hands each item yielded by the spider to the background writers.
+
+        Change detection, logging and database persistence happen in
+        `_write_batch` (for books) and `_drain_html` (for raw pages); this
+        only waits when the corresponding write queue is full.
+
+        Args:
+            item: The scraped item (expected to be a `Book` or `RawPage` object).
+            spider: The spider that yielded the item.
+
+        Returns:
+            The processed item. Raw pages are not returned: once queued for
+            archiving they are dropped, so that page bodies are not counted,
+            logged or exported as scraped items.
+        """
+        # Ensure we are only processing items of the correct type.
+        if isinstance(item, Book):
+            await self._queue.put(item)
+        elif isinstance(item, RawPage):
+            await self._html_queue.put(item)
+            raise DropItem(f"Raw page of book {item.id} queued for archiving", log_level="DEBUG")
         return item
@@ -1,7 +1,13 @@
-from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
+from typing import ClassVar, Optional
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 import hashlib
+import xxhash
+
+# An empty SHA256 context that `Book.compute_id` copies instead of constructing
+# a new hash object for every URL.
+_SHA_TEMPLATE = hashlib.sha256()
 
 class Book(BaseModel):
     """
@@ -9,6 +15,16 @@ class Book(BaseModel):
     This model is used for data validation and as a structured object
     before being saved to the database.
     """
+    # Books are immutable once scraped.
+    model_config = ConfigDict(
+        populate_by_name=True,
+        extra="ignore",
+        frozen=True,
+    )
+
+    # Fields whose changes are detected and logged between crawls.
+    TRACKED_FIELDS: ClassVar[tuple[str, ...]] = ("price_incl_tax", "availability", "rating")
+
     # --- Core Book Data ---
     # Fields directly scraped from the book's page.
     title: str
@@ -24,18 +40,16 @@ class Book(BaseModel):
     # --- Metadata ---
     # Data added during the crawling process for tracking and reference.
     url: str  # The source URL of the book page.
-    crawl_timestamp: datetime = Field(
-        default_factory=datetime.utcnow,
-        description="Timestamp in UTC of when the book was crawled."
-    )
-    
-    # --- Fallback Data ---
-    # Raw data stored for recovery or re-processing purposes.
-    raw_html: Optional[str] = Field(
+    crawl_timestamp: Optional[datetime] = Field(
         None,
-        description="The full raw HTML of the book page, stored for archival purposes."
+        description="Timestamp in UTC of the crawl run that scraped the book; set once per run by the spider."
     )
-    
+
+    # --- Change Detection ---
+    tracked_hash: bytes = Field(
+        description="xxh3-64 digest of the tracked fields, compared instead of the fields themselves to detect changes."
+    )
+
     # --- Database ID ---
     # The unique identifier for the database record.
     id: str = Field(
@@ -45,8 +59,35 @@ class Book(BaseModel):
 
     @classmethod
     def compute_id(cls, url: str) -> str:
-        """Computes a unique and stable SHA256 hash from the book's URL to use as the database _id."""
-        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+        """
+        Computes a unique and stable SHA256 hash from the book's URL to use as the database _id.
+
+        URLs handed out by Scrapy are already percent-encoded ASCII, so they are
+        encoded as ASCII, which gives the same bytes (and IDs) as UTF-8.
+        """
+        h = _SHA_TEMPLATE.copy()
+        h.update(url.encode('ascii'))
+        return h.hexdigest()
+
+    @classmethod
+    def compute_tracked_hash(cls, values: dict) -> bytes:
+        """Computes the 8-byte xxh3 digest of the `TRACKED_FIELDS` in a dictionary of book data."""
+        joined = "|".join(str(values.get(field)) for field in cls.TRACKED_FIELDS)
+        return xxhash.xxh3_64_digest(joined.encode('utf-8'))
+
+
+@dataclass(slots=True)
+class RawPage:
+    """
+    The raw HTML of a book page, yielded by the spider alongside its `Book`.
+
+    The HTML is kept out of the `Book` model so that the large page body does
+    not travel through validation and serialization with every book; the
+    pipeline archives it separately in GridFS. This is a plain dataclass
+    rather than a Pydantic model because the body needs no validation.
+    """
+    id: str  # The `_id` of the book the page belongs to.
+    body: bytes = field(repr=False)  # The page exactly as received from the server.
 
 
 class ChangeLog(BaseModel):
@@ -61,6 +102,6 @@ class ChangeLog(BaseModel):
     new_value: Optional[str] = Field(None, description="The value of the field after the change.")
     change_type: str = Field(description="The type of change, e.g., 'new' or 'update'.")
     timestamp: datetime = Field(
-        default_factory=datetime.utcnow,
+        default_factory=lambda: datetime.now(timezone.utc),
         description="Timestamp in UTC of when the change was detected."
     )
\ No newline at end of file
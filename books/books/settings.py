@@ -12,7 +12,7 @@ FEED_EXPORT_ENCODING = "utf-8"
 
 # --- ASYNC AND RESUMABILITY ---
 # This reactor is required to enable support for asyncio, which is needed
-# for the asynchronous 'motor' MongoDB driver used in the pipeline.
+# for PyMongo's asynchronous API (AsyncMongoClient) used in the pipeline.
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 
 # Specifies a directory where Scrapy will store the state of a crawl,
@@ -29,6 +29,8 @@ ITEM_PIPELINES = {
 MONGO_URI = "mongodb://127.0.0.1:27017"
 # The specific database to use within the MongoDB instance.
 MONGO_DATABASE = "books_db"
+# Number of books the pipeline writes to MongoDB in one bulk operation.
+MONGO_BATCH_SIZE = 500
 
 # --- CRAWLING POLITENESS AND SPEED ---
 # Respect the rules defined in the target website's robots.txt file.
@@ -39,12 +41,22 @@ ROBOTSTXT_OBEY = True
 AUTOTHROTTLE_ENABLED = True
 AUTOTHROTTLE_START_DELAY = 5  # The initial download delay (in seconds).
 AUTOTHROTTLE_MAX_DELAY = 60   # The maximum download delay to be set in case of high latencies.
-AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0 # The average number of parallel requests to send.
+AUTOTHROTTLE_TARGET_CONCURRENCY = 16.0 # The average number of parallel requests to send.
 # AUTOTHROTTLE_DEBUG = True  # Uncomment to see throttling stats for every response.
 
-# The number of concurrent (parallel) requests to perform per domain.
+# The number of concurrent (parallel) requests to perform, overall and per domain.
 # AutoThrottle will manage the delay, but this sets an upper limit on parallelism.
-CONCURRENT_REQUESTS_PER_DOMAIN = 8
+# Every request goes to the same site, so the per-domain limit is the one that binds.
+CONCURRENT_REQUESTS = 64
+CONCURRENT_REQUESTS_PER_DOMAIN = 32
+# Threads available for DNS resolution and other blocking calls.
+REACTOR_THREADPOOL_MAXSIZE = 20
+
+# Fetch HTTPS pages over HTTP/2, multiplexing the parallel requests over a
+# single connection instead of opening one connection per request.
+DOWNLOAD_HANDLERS = {
+    "https": "scrapy.core.downloader.handlers.http2.H2DownloadHandler",
+}
 
 # --- ERROR HANDLING ---
 # A list of HTTP status codes that should trigger a retry.
@@ -1,5 +1,34 @@
+from datetime import datetime, timezone
+
 import scrapy
-from ..schema import Book
+from lxml import etree
+from parsel.csstranslator import css2xpath
+from selectolax.parser import HTMLParser, Node
+from ..schema import Book, RawPage
+
+
+def _compile(xpath: str) -> etree.XPath:
+    """Compiles an XPath expression that returns plain strings rather than lxml "smart" strings."""
+    return etree.XPath(xpath, smart_strings=False)
+
+
+def _first(xpath: etree.XPath, root, **variables):
+    """Evaluates a compiled XPath against a document root and returns the first result, or None."""
+    result = xpath(root, **variables)
+    return result[0] if result else None
+
+
+def _text(root: HTMLParser | Node, selector: str):
+    """Returns the text of the first node under `root` matching a CSS selector, or None."""
+    node = root.css_first(selector)
+    return node.text() if node is not None else None
+
+
+def _attr(root: HTMLParser | Node, selector: str, name: str):
+    """Returns an attribute of the first node under `root` matching a CSS selector, or None."""
+    node = root.css_first(selector)
+    return node.attributes.get(name) if node is not None else None
+
 
 class BookSpider(scrapy.Spider):
     """
@@ -10,12 +39,23 @@ class BookSpider(scrapy.Spider):
     2. Navigates through each book category's pagination.
     3. Follows the link to each individual book's detail page.
     4. Scrapes the required data from the detail page.
-    5. Yields a Pydantic `Book` object for each book to be processed by the pipeline.
+    5. Yields a Pydantic `Book` object for each book to be processed by the pipeline,
+       followed by a `RawPage` carrying the page's HTML for archiving.
     """
     name = "book"
     allowed_domains = ["books.toscrape.com"]
     start_urls = ["https://books.toscrape.com/"]
 
+    # Listing page selectors, compiled once for the spider class instead of
+    # being rebuilt and re-parsed for every response.
+    _BOOK_LINKS = _compile(css2xpath("article.product_pod h3 > a::attr(href)"))
+    _NEXT_PAGE = _compile(css2xpath("li.next > a::attr(href)"))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A single timestamp (in UTC) for the whole run, shared by every book it scrapes.
+        self.run_ts = datetime.now(timezone.utc)
+
     def parse(self, response, **kwargs):
         """
         Parses category or main pages, follows links to book detail pages,
@@ -23,54 +63,103 @@ class BookSpider(scrapy.Spider):
 
         Args:
             response: The Scrapy Response object for the current page.
+
+        Returns:
+            A list with every request for this page, built in one go rather
+            than yielded one at a time.
         """
+        root = response.selector.root
+
         # Find all book links on the current page and schedule them to be parsed.
-        for book_link in response.css("article.product_pod h3 > a::attr(href)").getall():
-            yield response.follow(book_link, callback=self.parse_book_details)
+        # Each book's ID is computed here, once, and travels in the request's meta.
+        # Detail pages take priority over further listing pages, which keeps
+        # the scheduler queue from growing with pending book links.
+        requests = list(response.follow_all(
+            self._BOOK_LINKS(root), callback=self.parse_book_details, priority=1
+        ))
+        for request in requests:
+            request.meta["book_id"] = Book.compute_id(request.url)
 
         # Find the 'next' page button and, if it exists, follow it to continue crawling.
-        next_page = response.css("li.next > a::attr(href)").get()
+        next_page = _first(self._NEXT_PAGE, root)
         if next_page:
-            yield response.follow(next_page, callback=self.parse)
+            requests.append(response.follow(next_page, callback=self.parse))
+        return requests
 
     def parse_book_details(self, response, **kwargs):
         """
         Parses the book detail page to extract all required data fields.
 
         This method constructs a Pydantic `Book` item from the scraped data
-        and yields it for the item pipeline to process.
+        and yields it, together with the raw page, for the item pipeline to
+        process. Detail pages are parsed with selectolax rather than Scrapy's
+        lxml-backed selectors, which is considerably faster for this
+        extract-only workload.
 
         Args:
             response: The Scrapy Response object for the book detail page.
         """
         try:
-            # A helper function to robustly extract data from the product information table.
-            def get_table_value(key: str) -> str:
-                """Finds a key in the product table and returns its corresponding value."""
-                return response.xpath(f"//th[text()='{key}']/following-sibling::td/text()").get()
+            tree = HTMLParser(response.body)
+
+            # Locate the product summary and information table once; the
+            # selectors below only search within them instead of the whole page.
+            product_main = tree.css_first("div.product_main")
+            if product_main is None:
+                product_main = tree
+            table = tree.css_first("table.table-striped")
+
+            # Read the product information table in a single pass, keyed by
+            # each row's header (e.g. 'Price (incl. tax)').
+            product_info = {}
+            for row in table.css("tr") if table is not None else ():
+                header, value = row.css_first("th"), row.css_first("td")
+                if header is not None and value is not None:
+                    product_info[header.text()] = value.text()
+
+            # Detail requests carry the ID computed when they were scheduled.
+            # That ID hashes the scheduled URL, so after a redirect it is
+            # recomputed from the final URL, which is the one stored.
+            book_id = response.meta.get("book_id")
+            if book_id is None or response.meta.get("redirect_urls"):
+                book_id = Book.compute_id(response.url)
 
             # Create a dictionary with all the scraped data.
             # This dictionary will be used to instantiate the Pydantic `Book` model.
             book_data = {
                 "url": response.url,
-                "_id": Book.compute_id(response.url),
-                "title": response.css("div.product_main h1::text").get(),
-                "description": response.xpath("//div[@id='product_description']/following-sibling::p/text()").get(),
-                "category": response.xpath("//ul[@class='breadcrumb']/li[3]/a/text()").get(),
-                "price_incl_tax": get_table_value("Price (incl. tax)"),
-                "price_excl_tax": get_table_value("Price (excl. tax)"),
-                "availability": get_table_value("Availability"),
-                "reviews": int(get_table_value("Number of reviews") or 0),
-                "image_url": response.urljoin(response.css("div.item.active > img::attr(src)").get()),
-                "rating": response.css("p.star-rating::attr(class)").get().replace("star-rating ", ""),
-                "raw_html": response.body.decode('utf-8'),
+                "_id": book_id,
+                "crawl_timestamp": self.run_ts,
+                "title": _text(product_main, "h1"),
+                "description": _text(tree, "#product_description ~ p"),
+                "category": _text(tree, "ul.breadcrumb > li:nth-child(3) > a"),
+                "price_incl_tax": product_info.get("Price (incl. tax)"),
+                "price_excl_tax": product_info.get("Price (excl. tax)"),
+                "availability": product_info.get("Availability"),
+                "reviews": int(product_info.get("Number of reviews") or 0),
+                "image_url": response.urljoin(_attr(tree, "div.item.active > img", "src")),
+                "rating": _attr(product_main, "p.star-rating", "class").replace("star-rating ", ""),
             }
-            
-            # Yield a validated Book object for the pipeline.
-            yield Book(**book_data)
+            book_data["tracked_hash"] = Book.compute_tracked_hash(book_data)
+
+            # The scraped values already have the right types, so when every
+            # field except the optional description is present the Book is
+            # built without running the validators. Otherwise validation runs
+            # so that the error names the missing fields.
+            if all(value is not None for key, value in book_data.items() if key != "description"):
+                book = Book.model_construct(**book_data)
+            else:
+                book = Book.model_validate(book_data)
 
         except Exception as e:
             self.logger.error(
                 f"Failed to parse book details for URL {response.url}: {e}", 
                 exc_info=True
             )
+            return
+
+        # Only the extraction above is guarded; the items are yielded outside
+        # the try block.
+        yield book
+        # The HTML travels separately so the `Book` item stays small.
+        yield RawPage(id=book.id, body=response.body)
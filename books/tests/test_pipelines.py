@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+from scrapy.exceptions import DropItem
+
+from books.pipelines import MongoPipeline
+from books.schema import RawPage
+
+
+def test_raw_page_is_queued_and_dropped():
+    """A raw page goes to the archive queue and is not passed on as a scraped item."""
+    pipeline = MongoPipeline("mongodb://127.0.0.1:27017", "books_db")
+    page = RawPage(id="a" * 64, body=b"<html></html>")
+
+    async def process():
+        pipeline._html_queue = asyncio.Queue()
+        with pytest.raises(DropItem) as dropped:
+            await pipeline.process_item(page, spider=None)
+        return dropped.value, pipeline._html_queue.get_nowait()
+
+    dropped, queued = asyncio.run(process())
+    assert queued is page
+    assert dropped.log_level == "DEBUG"
+    assert "<html>" not in repr(page)
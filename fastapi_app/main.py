@@ -1,31 +1,69 @@
+import re
+
 from fastapi import FastAPI, HTTPException, Path, Query
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
-import re
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient
+from cachetools import TTLCache
 
 # --- FastAPI Setup ---
 app = FastAPI(
     title="FilersKeepers Book API",
     description="REST API serving scraped books data from MongoDB.",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # --- MongoDB Connection ---
 MONGO_URI = "mongodb://localhost:27017"  # change if needed
-client = AsyncIOMotorClient(MONGO_URI)
+# One client, and so one connection pool, is shared by every request. The
+# pool keeps warm connections ready and is sized for concurrent requests;
+# an unreachable server fails requests after 5s instead of the default 30s.
+client = AsyncMongoClient(
+    MONGO_URI,
+    maxPoolSize=100,
+    minPoolSize=10,
+    serverSelectionTimeoutMS=5000,
+)
 db = client["books_db"]
 books_collection = db["books"]
 
-# --- Rating Conversion Map ---
-RATING_MAP = {
-    "One": 1.0,
-    "Two": 2.0,
-    "Three": 3.0,
-    "Four": 4.0,
-    "Five": 5.0,
+# --- Result Caches ---
+# Repeated queries are answered from memory; entries simply expire, so
+# freshly scraped data shows up after at most `ttl` seconds.
+books_cache = TTLCache(maxsize=1024, ttl=60)
+stats_cache = TTLCache(maxsize=1, ttl=30)
+
+# --- Book ID Format ---
+# Book IDs are the SHA-256 hex digest of the book's URL, set by the scraper.
+_ID_RE = re.compile(r"[0-9a-f]{64}")
+
+# --- Sort Field Map ---
+# API sort keys → the numeric fields stored at ingest time that MongoDB sorts on.
+SORT_FIELDS = {
+    "rating": "rating_numeric",
+    "price": "price_numeric",
+    "reviews": "reviews",
+}
+
+# --- List Projection ---
+# Fields returned by the book listing. They match the listing index created
+# by the scraper's pipeline, so a listing filtered by category is answered
+# from the index alone; without a category, MongoDB still fetches documents
+# or scans the whole index. The description is only served by the
+# single-book endpoint.
+LIST_PROJECTION = {
+    "title": 1,
+    "category": 1,
+    "price_numeric": 1,
+    "rating_numeric": 1,
+    "reviews": 1,
+    "availability": 1,
+    "image_url": 1,
+    "url": 1,
+    "crawl_timestamp": 1,
 }
 
 # --- Pydantic Model ---
@@ -44,30 +82,22 @@ class Book(BaseModel):
 
 
 # --- Utility Functions ---
-def parse_price(price_str: Optional[str]) -> Optional[float]:
-    """Convert price like '£18.02' → 18.02."""
-    if not price_str:
-        return None
-    match = re.search(r"[\d.]+", price_str)
-    return float(match.group()) if match else None
-
-
-def rating_to_float(rating_str: Optional[str]) -> Optional[float]:
-    """Convert text rating ('Two') → 2.0."""
-    return RATING_MAP.get(rating_str.strip().title(), None) if rating_str else None
-
-
 def book_from_mongo(doc: dict) -> Book:
-    """Convert MongoDB document to Pydantic Book model."""
-    return Book(
+    """
+    Convert MongoDB document to Pydantic Book model.
+
+    Documents were validated by the scraper before they were stored, so the
+    model is built without validating them again.
+    """
+    return Book.model_construct(
         id=str(doc.get("_id")),
         title=doc.get("title", "Unknown"),
         description=doc.get("description"),
         category=doc.get("category", "Default"),
-        price=parse_price(doc.get("price_incl_tax")),
+        price=doc.get("price_numeric"),
         availability=doc.get("availability"),
         reviews=doc.get("reviews", 0),
-        rating=rating_to_float(doc.get("rating")),
+        rating=doc.get("rating_numeric"),
         image_url=doc.get("image_url"),
         url=doc.get("url"),
         crawl_timestamp=doc.get("crawl_timestamp"),
@@ -75,7 +105,7 @@ def book_from_mongo(doc: dict) -> Book:
 
 # --- API Endpoints ---
 
-@app.get("/books", response_model=List[Book])
+@app.get("/books", response_model=None, responses={200: {"model": List[Book]}})
 async def get_books(
     category: Optional[str] = Query(None, description="Filter books by category"),
     min_price: Optional[float] = Query(None, ge=0),
@@ -87,44 +117,48 @@ async def get_books(
 ):
     """
     Retrieve books with optional filters and sorting from MongoDB.
+
+    List entries leave out the description, which is always null here;
+    use `GET /books/{book_id}` for a book's full details.
     """
+    cache_key = (category, min_price, max_price, rating, sort_by, skip, limit)
+    cached = books_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     query = {}
 
-    # Category filter (case-insensitive)
+    # Category filter (case-insensitive), on the lowercased category stored at ingest time
     if category:
-        query["category"] = {"$regex": f"^{category}$", "$options": "i"}
+        query["category_lower"] = category.lower()
 
-    # Price filter (parsed at runtime)
+    # Price filter, on the numeric price stored at ingest time
     price_conditions = {}
     if min_price is not None:
         price_conditions["$gte"] = min_price
     if max_price is not None:
         price_conditions["$lte"] = max_price
     if price_conditions:
-        # We only have price as string, so we must fetch all and filter manually
-        docs = books_collection.find(query)
-        all_books = [book_from_mongo(doc) async for doc in docs]
-        filtered_books = [
-            b for b in all_books
-            if b.price is not None
-            and (min_price is None or b.price >= min_price)
-            and (max_price is None or b.price <= max_price)
-        ]
-    else:
-        cursor = books_collection.find(query)
-        filtered_books = [book_from_mongo(doc) async for doc in cursor]
-
-    # Filter by rating
+        query["price_numeric"] = price_conditions
+
+    # Rating filter, on the numeric rating stored at ingest time
     if rating is not None:
-        filtered_books = [b for b in filtered_books if b.rating and b.rating >= rating]
+        query["rating_numeric"] = {"$gte": rating}
 
-    # Sort
+    cursor = books_collection.find(query, LIST_PROJECTION)
+
+    # Sort in MongoDB; `_id` breaks ties so that pages never overlap.
     if sort_by:
-        reverse = sort_by in ["rating", "reviews"]
-        filtered_books.sort(key=lambda b: getattr(b, sort_by, 0) or 0, reverse=reverse)
+        direction = DESCENDING if sort_by in ["rating", "reviews"] else ASCENDING
+        cursor = cursor.sort([(SORT_FIELDS[sort_by], direction), ("_id", ASCENDING)])
+
+    # Pagination; the whole page arrives in a single batch.
+    cursor = cursor.skip(skip).limit(limit).batch_size(limit)
+    docs = await cursor.to_list(length=limit)
+    books = [book_from_mongo(doc).model_dump() for doc in docs]
 
-    # Pagination
-    return filtered_books[skip: skip + limit]
+    books_cache[cache_key] = books
+    return books
 
 
 @app.get("/books/{book_id}", response_model=Book)
@@ -132,12 +166,10 @@ async def get_book(book_id: str = Path(..., description="The MongoDB _id of the
     """
     Retrieve details about a specific book by its MongoDB _id.
     """
-    try:
-        oid = ObjectId(book_id)
-    except Exception:
+    if not _ID_RE.fullmatch(book_id):
         raise HTTPException(status_code=400, detail="Invalid book ID format")
 
-    doc = await books_collection.find_one({"_id": oid})
+    doc = await books_collection.find_one({"_id": book_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Book not found")
 
@@ -149,9 +181,29 @@ async def get_summary_stats():
     """
     Simple stats endpoint: count books, average price, etc.
     """
-    count = await books_collection.count_documents({})
-    sample = await books_collection.find_one()
-    return {"total_books": count, "example_title": sample.get("title") if sample else None}
+    cached = stats_cache.get("stats")
+    if cached is not None:
+        return cached
+
+    # All figures come from a single aggregation, i.e. one round trip.
+    pipeline = [{"$facet": {
+        "total": [{"$count": "n"}],
+        "sample": [{"$limit": 1}, {"$project": {"title": 1}}],
+        "avg_price": [{"$group": {"_id": None, "v": {"$avg": "$price_numeric"}}}],
+    }}]
+    cursor = await books_collection.aggregate(pipeline)
+    [result] = await cursor.to_list(1)
+
+    total, sample, avg_price = result["total"], result["sample"], result["avg_price"]
+    average = avg_price[0]["v"] if avg_price else None
+    stats = {
+        "total_books": total[0]["n"] if total else 0,
+        "example_title": sample[0].get("title") if sample else None,
+        "average_price": round(average, 2) if average is not None else None,
+    }
+
+    stats_cache["stats"] = stats
+    return stats
 
 
 # --- Run the app ---
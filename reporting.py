@@ -14,9 +14,11 @@ Usage:
 import asyncio
 import argparse
 import csv
-import json
-from datetime import datetime, timedelta
-import motor.motor_asyncio
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+import orjson
+from pymongo import DESCENDING, AsyncMongoClient
 
 # --- Database Configuration ---
 # These settings should match the ones used in the Scrapy project.
@@ -24,18 +26,21 @@ MONGO_URI = "mongodb://127.0.0.1:27017"
 MONGO_DATABASE = "books_db"
 CHANGELOG_COLLECTION = "changelog"
 
-async def get_daily_changes() -> list:
+# A single client for the whole script; its connection is opened on first use
+# and reused by every query.
+client = AsyncMongoClient(MONGO_URI)
+db = client[MONGO_DATABASE]
+
+def get_daily_changes() -> AsyncIterator[dict]:
     """
-    Connects to MongoDB and fetches all change log entries from the last 24 hours.
+    Queries all change log entries from the last 24 hours.
 
     Returns:
-        A list of dictionaries, where each dictionary is a change log document.
+        An async cursor yielding each change log document as a dictionary.
+        Documents are fetched from the server in batches as the cursor is read.
     """
-    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
-    db = client[MONGO_DATABASE]
-    
     # Calculate the datetime for 24 hours ago to filter recent changes.
-    time_threshold = datetime.utcnow() - timedelta(hours=24)
+    time_threshold = datetime.now(timezone.utc) - timedelta(hours=24)
     
     # Query the database for all documents newer than the threshold.
     cursor = db[CHANGELOG_COLLECTION].find(
@@ -43,48 +48,52 @@ async def get_daily_changes() -> list:
         # Exclude the internal MongoDB '_id' field from the results for cleaner output.
         {"_id": 0}
     )
-    
-    changes = await cursor.to_list(length=None)
-    client.close()
-    return changes
+    # List the newest changes first, following the changelog's timestamp index.
+    return cursor.sort("timestamp", DESCENDING)
 
-def generate_json_report(changes: list, filename: str = "daily_report.json"):
+async def _prepend(first: dict, changes: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """Yields `first`, then the remaining documents of `changes`."""
+    yield first
+    async for change in changes:
+        yield change
+
+async def generate_json_report(changes: AsyncIterator[dict], filename: str = "daily_report.json"):
     """
-    Writes the list of change documents to a pretty-printed JSON file.
+    Streams the change documents into a pretty-printed JSON array file.
 
     Args:
-        changes: A list of change log documents.
+        changes: An async iterator of change log documents.
         filename: The name of the output file.
     """
-    # Convert datetime objects to ISO 8601 strings, as datetime objects
-    # are not directly serializable to JSON.
-    for change in changes:
-        if isinstance(change.get("timestamp"), datetime):
-            change["timestamp"] = change["timestamp"].isoformat()
-
-    with open(filename, "w") as f:
-        json.dump(changes, f, indent=4)
+    # Each document is serialized and written as it arrives, so neither the
+    # full list nor the full JSON text is ever held in memory. orjson writes
+    # datetime objects as ISO 8601 strings.
+    with open(filename, "wb") as f:
+        f.write(b"[")
+        separator = b"\n"
+        async for change in changes:
+            f.write(separator)
+            f.write(orjson.dumps(change, option=orjson.OPT_INDENT_2))
+            separator = b",\n"
+        f.write(b"\n]\n")
     print(f"Successfully generated JSON report: {filename}")
 
-def generate_csv_report(changes: list, filename: str = "daily_report.csv"):
+async def generate_csv_report(changes: AsyncIterator[dict], filename: str = "daily_report.csv"):
     """
-    Writes the list of change documents to a CSV file.
+    Streams the change documents into a CSV file.
 
     Args:
-        changes: A list of change log documents.
+        changes: An async iterator of change log documents.
         filename: The name of the output file.
     """
-    if not changes:
-        print("No changes to report.")
-        return
-
     # Define the headers for the CSV file in a logical order.
     fieldnames = ["timestamp", "book_id", "change_type", "field_changed", "old_value", "new_value"]
     
     with open(filename, "w", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
         writer.writeheader()
-        writer.writerows(changes)
+        async for change in changes:
+            writer.writerow(change)
     print(f"Successfully generated CSV report: {filename}")
 
 async def main():
@@ -105,16 +114,23 @@ async def main():
     args = parser.parse_args()
 
     print("Fetching changes from the last 24 hours...")
-    changes = await get_daily_changes()
-
-    if not changes:
-        print("No changes found in the last 24 hours.")
-        return
-
-    if args.format == "json":
-        generate_json_report(changes)
-    elif args.format == "csv":
-        generate_csv_report(changes)
+    try:
+        changes = get_daily_changes()
+
+        # Read the first change up front so that no report file is written
+        # when there is nothing to report.
+        first = await anext(changes, None)
+        if first is None:
+            print("No changes found in the last 24 hours.")
+            return
+        changes = _prepend(first, changes)
+
+        if args.format == "json":
+            await generate_json_report(changes)
+        elif args.format == "csv":
+            await generate_csv_report(changes)
+    finally:
+        await client.close()
 
 if __name__ == "__main__":
     # Use asyncio.run() to execute the async main function.